@@ -1,4 +1,51 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from dbutil import QUERIES
+
+# Bounds used when since/until are not given. Check dates are stored as
+# 'YYYY-MM-DD HH:MM:SS' text, so these sort before and after every stored value
+# and the range predicates can always use the check-off indexes.
+MIN_CHECK_DATE = ''
+MAX_CHECK_DATE = '9999-12-32'
+
+
+def to_date(value):
+    """
+    Converts a date, datetime or 'YYYY-MM-DD...' string to a date.
+
+    Args:
+        value: The value to convert. None and empty strings are treated as missing.
+
+    Returns:
+        date: The converted date, or None if the value is missing.
+
+    Raises:
+        ValueError: If a string does not start with a 'YYYY-MM-DD' date.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def checkdate_bounds(since=None, until=None):
+    """
+    Converts an inclusive since/until date range into half-open bounds on check_date.
+
+    Args:
+        since (date or str, optional): The first day to include.
+        until (date or str, optional): The last day to include.
+
+    Returns:
+        tuple: (lower, upper) strings to use as check_date >= lower AND check_date < upper.
+    """
+    since, until = to_date(since), to_date(until)
+    lower = since.isoformat() if since else MIN_CHECK_DATE
+    upper = (until + timedelta(days=1)).isoformat() if until else MAX_CHECK_DATE
+    return lower, upper
+
 
 class CheckOff:
     """
@@ -30,31 +77,35 @@ class CheckOff:
         Raises:
             DatabaseError: If there is an issue with the database operation.
         """
-        query = 'INSERT INTO check_off (habit_id, check_date) VALUES (?, ?)'
-        self.db.execute_query(query, (self.habit_id, self.check_date))
+        self.db.execute_query(QUERIES['checkoff.insert'], (self.habit_id, self.check_date))
 
     @staticmethod
-    def get_all(db):
+    def get_all(db, since=None, until=None):
         """
-        Retrieves all check-offs from the database.
+        Retrieves all check-offs from the database, optionally limited to a date range.
 
         Args:
             db (Database): The database connection instance.
+            since (date or str, optional): The first check-off day to include.
+            until (date or str, optional): The last check-off day to include.
 
         Returns:
             list: A list of all check-offs in the database.
         """
-        query = 'SELECT * FROM check_off'
-        return db.fetch_all(query)
+        if since is None and until is None:
+            return db.fetch_all(QUERIES['checkoff.get_all'])
+        return db.fetch_all(QUERIES['checkoff.get_all_in_range'], checkdate_bounds(since, until))
     
     @staticmethod
-    def get_checkdates_for_habit(db, habit_id):
+    def get_checkdates_for_habit(db, habit_id, since=None, until=None):
         """
         Retrieves all check-off dates for a specific habit, ordered by date.
 
         Args:
             db (Database): The database connection instance.
             habit_id (int): The ID of the habit.
+            since (date or str, optional): The first check-off day to include.
+            until (date or str, optional): The last check-off day to include.
 
         Returns:
             list: A list of date objects representing the check-off dates.
@@ -62,30 +113,78 @@ class CheckOff:
         Raises:
             ValueError: If a date string in the database cannot be parsed.
         """
-        data_list = db.fetch_all('SELECT check_date FROM check_off WHERE habit_id = ? ORDER BY check_date', (habit_id,))
+        query = QUERIES['checkoff.checkdates_for_habit']
+        data_list = db.fetch_all(query, (habit_id, *checkdate_bounds(since, until)))
         date_objects = []
         for date_str in data_list:
-            try:
-                datetime_obj = datetime.strptime(date_str[0], '%Y-%m-%d %H:%M:%S')
-                date_objects.append(datetime_obj.date())
-            except ValueError:
-                print(f"Invalid date format: {date_str}")
+            check_date = CheckOff._parse_check_date(date_str[0])
+            if check_date is not None:
+                date_objects.append(check_date)
         return date_objects
 
     @staticmethod
-    def get_by_habit(db, habit_id):
+    def get_checkdates_for_habits(db, habit_ids, since=None, until=None, clip_to_active=False):
+        """
+        Retrieves the check-off dates for several habits in a single query.
+
+        Args:
+            db (Database): The database connection instance.
+            habit_ids (iterable): The IDs of the habits; strings such as '1' are converted to int.
+            since (date or str, optional): The first check-off day to include.
+            until (date or str, optional): The last check-off day to include.
+            clip_to_active (bool, optional): Also bound each habit's check-offs by its own
+                startdate and enddate in the query. Defaults to False.
+
+        Returns:
+            dict: Maps each habit ID to a list of its check-off dates, ordered by date.
+        """
+        habit_ids = [int(habit_id) for habit_id in habit_ids]
+        date_objects = {habit_id: [] for habit_id in habit_ids}
+        lower, upper = checkdate_bounds(since, until)
+        if clip_to_active:
+            query, params = QUERIES['checkoff.checkdates_for_habits_active'], (lower, upper, upper)
+        else:
+            query, params = QUERIES['checkoff.checkdates_for_habits'], (lower, upper)
+        for habit_id, date_str in db.fetch_all_for_ids(query, habit_ids, params):
+            check_date = CheckOff._parse_check_date(date_str)
+            if check_date is not None:
+                date_objects[habit_id].append(check_date)
+        return date_objects
+
+    @staticmethod
+    def _parse_check_date(date_str):
+        """
+        Parses a stored check date, reporting values in an unexpected format.
+
+        Args:
+            date_str (str): The check_date value from the database.
+
+        Returns:
+            date: The parsed date, or None if the value could not be parsed.
+        """
+        try:
+            return datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S').date()
+        except ValueError:
+            print(f"Invalid date format: {date_str}")
+            return None
+
+    @staticmethod
+    def get_by_habit(db, habit_id, since=None, until=None):
         """
         Retrieves all check-offs for a specific habit.
 
         Args:
             db (Database): The database connection instance.
             habit_id (int): The ID of the habit.
+            since (date or str, optional): The first check-off day to include.
+            until (date or str, optional): The last check-off day to include.
 
         Returns:
             list: A list of check-offs for the specified habit.
         """
-        query = 'SELECT * FROM check_off WHERE habit_id = ?'
-        return db.fetch_all(query, (habit_id,))
+        if since is None and until is None:
+            return db.fetch_all(QUERIES['checkoff.get_by_habit'], (habit_id,))
+        return db.fetch_all(QUERIES['checkoff.get_by_habit_in_range'], (habit_id, *checkdate_bounds(since, until)))
 
     @staticmethod
     def update(db, checkoff_id, habit_id, check_date):
@@ -101,8 +200,7 @@ class CheckOff:
         Raises:
             DatabaseError: If there is an issue with the database operation.
         """
-        query = 'UPDATE check_off SET habit_id = ?, check_date = ? WHERE id = ?'
-        db.execute_query(query, (habit_id, check_date, checkoff_id))
+        db.execute_query(QUERIES['checkoff.update'], (habit_id, check_date, checkoff_id))
 
     @staticmethod
     def delete(db, checkoff_id):
@@ -116,5 +214,4 @@ class CheckOff:
         Raises:
             DatabaseError: If there is an issue with the database operation.
         """
-        query = 'DELETE FROM check_off WHERE id = ?'
-        db.execute_query(query, (checkoff_id,))
+        db.execute_query(QUERIES['checkoff.delete'], (checkoff_id,))
@@ -0,0 +1,308 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from dbutil import QUERIES
+
+# Sentinel placed on the queue to stop the background thread.
+_STOP = object()
+
+
+class BufferedCheckOffWriter:
+    """
+    Buffers check-offs from many threads and writes them in group commits.
+
+    Check-offs are placed on a bounded queue and written by a single background
+    thread with one executemany call per batch. A batch is flushed when it reaches
+    batch_size entries or when flush_interval seconds have passed since its first
+    entry. Duplicate (habit_id, check_date) pairs within a batch are written once.
+
+    Attributes:
+        db (Database): The database instance to write to.
+        batch_size (int): The number of distinct check-offs that triggers a flush.
+        flush_interval (float): The maximum time in seconds a check-off waits in a batch.
+        wait_for_flush (bool): Whether add() returns a Future resolved after the commit.
+    """
+
+    def __init__(self, db, batch_size=500, flush_interval=0.05, max_queue_size=10000, wait_for_flush=True):
+        """
+        Initializes the writer and starts its background thread.
+
+        Args:
+            db (Database): The database instance to write to.
+            batch_size (int, optional): The number of distinct check-offs per group commit. Defaults to 500.
+            flush_interval (float, optional): The maximum batching delay in seconds. Defaults to 0.05.
+            max_queue_size (int, optional): The capacity of the queue; add() blocks when it is full. Defaults to 10000.
+            wait_for_flush (bool, optional): If True, add() returns a Future that completes once the
+                check-off is committed. If False, check-offs are fire-and-forget. Defaults to True.
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.wait_for_flush = wait_for_flush
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        # Guards _closed and _pending_puts. Queuing happens outside the lock so a producer
+        # blocked on a full queue does not hold up the others; _pending_puts lets the
+        # background thread wait for those producers before it stops.
+        self._state = threading.Condition()
+        self._pending_puts = 0
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'submitted': 0,
+            'written': 0,
+            'deduplicated': 0,
+            'flushes': 0,
+            'errors': 0,
+            'last_flush_seconds': 0.0,
+            'max_flush_seconds': 0.0,
+            'total_flush_seconds': 0.0,
+        }
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, name='BufferedCheckOffWriter', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, habit_id, check_date, timeout=None):
+        """
+        Queues a check-off for writing.
+
+        Args:
+            habit_id (int): The ID of the habit associated with the check-off.
+            check_date (str): The date the habit was completed.
+            timeout (float, optional): How long to block if the queue is full. Defaults to blocking forever.
+
+        Returns:
+            Future: A future resolved when the check-off is committed, or None if the
+            writer was created with wait_for_flush=False.
+
+        Raises:
+            RuntimeError: If the writer has been closed.
+            queue.Full: If the queue stays full for longer than timeout.
+        """
+        future = None
+        if self.wait_for_flush:
+            future = Future()
+            # Mark the future as running so callers cannot cancel it once it is queued.
+            future.set_running_or_notify_cancel()
+        if not self._put(((habit_id, check_date), future), timeout):
+            raise RuntimeError('BufferedCheckOffWriter is closed')
+        with self._metrics_lock:
+            self._metrics['submitted'] += 1
+        return future
+
+    def save(self, checkoff, timeout=None):
+        """
+        Queues an existing CheckOff instance for writing.
+
+        Args:
+            checkoff (CheckOff): The check-off to write.
+            timeout (float, optional): How long to block if the queue is full.
+
+        Returns:
+            Future: See add().
+        """
+        return self.add(checkoff.habit_id, checkoff.check_date, timeout=timeout)
+
+    def flush(self, timeout=None):
+        """
+        Writes everything queued so far and waits for the commit.
+
+        Args:
+            timeout (float, optional): The maximum time in seconds to wait.
+        """
+        done = threading.Event()
+        if self._put((None, done)):
+            done.wait(timeout)
+
+    def close(self, timeout=None):
+        """
+        Flushes all queued check-offs and stops the background thread.
+
+        Args:
+            timeout (float, optional): The maximum time in seconds to wait for the thread.
+        """
+        with self._state:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put((_STOP, None))
+        self._thread.join(timeout)
+
+    @property
+    def queue_depth(self):
+        """
+        int: The number of check-offs waiting on the queue.
+        """
+        return self._queue.qsize()
+
+    def metrics(self):
+        """
+        Returns a snapshot of the writer's counters.
+
+        Returns:
+            dict: Queue depth, submitted/written/deduplicated counts, flush count,
+            error count and last/max/average flush latency in seconds.
+        """
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        flushes = metrics['flushes']
+        metrics['avg_flush_seconds'] = metrics['total_flush_seconds'] / flushes if flushes else 0.0
+        metrics['queue_depth'] = self.queue_depth
+        return metrics
+
+    def _put(self, item, timeout=None):
+        """
+        Queues an item unless the writer is closed.
+
+        Args:
+            item (tuple): A (key, waiter) pair for the background thread.
+            timeout (float, optional): How long to block if the queue is full.
+
+        Returns:
+            bool: False if the writer is closed and nothing was queued.
+
+        Raises:
+            queue.Full: If the queue stays full for longer than timeout.
+        """
+        with self._state:
+            if self._closed:
+                return False
+            self._pending_puts += 1
+        try:
+            self._queue.put(item, timeout=timeout)
+        finally:
+            with self._state:
+                self._pending_puts -= 1
+                self._state.notify_all()
+        return True
+
+    def _run(self):
+        """
+        Background loop: collects queued check-offs into batches and flushes them.
+        """
+        # Maps (habit_id, check_date) to the futures waiting on it; dicts keep
+        # insertion order so rows are written in arrival order.
+        batch = {}
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                key, waiter = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush(batch)
+                batch, deadline = {}, None
+                continue
+
+            if key is _STOP:
+                self._drain(batch)
+                return
+            if key is None:
+                # Explicit flush request; waiter is a threading.Event.
+                self._flush(batch)
+                batch, deadline = {}, None
+                waiter.set()
+                continue
+
+            self._add_to_batch(batch, key, waiter)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch, deadline = {}, None
+
+    def _drain(self, batch):
+        """
+        Writes what is left once the stop marker arrives: the current batch, anything
+        queued behind the marker and check-offs from add() calls that were still
+        blocked on a full queue when close() ran.
+
+        Args:
+            batch (dict): The batch being collected when the stop marker arrived.
+        """
+        flush_events = []
+        while True:
+            try:
+                key, waiter = self._queue.get_nowait()
+            except queue.Empty:
+                with self._state:
+                    if self._pending_puts:
+                        self._state.wait()
+                        continue
+                # The writer is closed and no put is in progress, so nothing more can arrive.
+                if self._queue.empty():
+                    break
+                continue
+
+            if key is None:
+                flush_events.append(waiter)
+                continue
+            self._add_to_batch(batch, key, waiter)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = {}
+
+        self._flush(batch)
+        for done in flush_events:
+            done.set()
+
+    def _add_to_batch(self, batch, key, waiter):
+        """
+        Adds a check-off to a batch, counting duplicates of a check-off already in it.
+
+        Args:
+            batch (dict): Maps (habit_id, check_date) to a list of waiting futures.
+            key (tuple): The (habit_id, check_date) pair.
+            waiter (Future): The check-off's future, or None.
+        """
+        if key in batch:
+            with self._metrics_lock:
+                self._metrics['deduplicated'] += 1
+        else:
+            batch[key] = []
+        if waiter is not None:
+            batch[key].append(waiter)
+
+    def _flush(self, batch):
+        """
+        Writes a batch in one transaction and resolves its futures.
+
+        Args:
+            batch (dict): Maps (habit_id, check_date) to a list of waiting futures.
+        """
+        if not batch:
+            return
+        started = time.monotonic()
+        error = None
+        try:
+            self.db.execute_many(QUERIES['checkoff.insert'], list(batch))
+        except Exception as e:
+            error = e
+        elapsed = time.monotonic() - started
+
+        with self._metrics_lock:
+            self._metrics['flushes'] += 1
+            self._metrics['last_flush_seconds'] = elapsed
+            self._metrics['max_flush_seconds'] = max(self._metrics['max_flush_seconds'], elapsed)
+            self._metrics['total_flush_seconds'] += elapsed
+            if error is None:
+                self._metrics['written'] += len(batch)
+            else:
+                self._metrics['errors'] += 1
+                self.last_error = error
+
+        for futures in batch.values():
+            for future in futures:
+                # A waiter that is already resolved must not stop the background thread.
+                try:
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+                except InvalidStateError:
+                    pass
@@ -1,22 +1,201 @@
+import bisect
+import hashlib
+import os
+import re
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+# sqlite3's default per-connection statement cache size.
+DEFAULT_STATEMENT_CACHE_SIZE = 128
+# Number of shards created for a new ShardedDatabase when no count is given.
+DEFAULT_SHARD_COUNT = 4
+# Upper bound on the threads used to fan a query out to tenant databases.
+MAX_FAN_OUT_WORKERS = 16
+
+
+class QueryRegistry:
+    """
+    A named collection of the application's SQL statements.
+
+    Looking statements up by name means every call site passes the exact same SQL
+    text, so each statement is compiled once per connection and then served from
+    the connection's statement cache.
+
+    Attributes:
+        queries (dict): Maps statement names to their SQL.
+    """
+
+    def __init__(self, queries=None):
+        """
+        Initializes the QueryRegistry instance.
+
+        Args:
+            queries (dict, optional): Statements to register, keyed by name.
+        """
+        self.queries = {}
+        for name, sql in (queries or {}).items():
+            self.register(name, sql)
+
+    def register(self, name, sql):
+        """
+        Registers a named statement.
+
+        Args:
+            name (str): The statement name, e.g. 'habit.get_all'.
+            sql (str): The SQL text.
+
+        Raises:
+            ValueError: If a different statement is already registered under the name.
+        """
+        if self.queries.get(name, sql) != sql:
+            raise ValueError(f"Query {name} is already registered")
+        self.queries[name] = sql
+
+    def __getitem__(self, name):
+        """
+        Returns the SQL registered under a name.
+
+        Raises:
+            KeyError: If no statement is registered under the name.
+        """
+        try:
+            return self.queries[name]
+        except KeyError:
+            raise KeyError(f"Unknown query: {name}") from None
+
+    def __contains__(self, name):
+        return name in self.queries
+
+    def __iter__(self):
+        return iter(self.queries)
+
+    def __len__(self):
+        return len(self.queries)
+
+
+# Every statement issued by the models, analytics and management commands.
+# Predicates on check_date use half-open [lower, upper) bounds (see checkoff.checkdate_bounds).
+QUERIES = QueryRegistry({
+    'frequency.insert': 'INSERT INTO frequency (name) VALUES (?)',
+    'frequency.get_all': 'SELECT * FROM frequency',
+    'frequency.update': 'UPDATE frequency SET name = ? WHERE id = ?',
+    'frequency.delete': 'DELETE FROM frequency WHERE id = ?',
+    'frequency.name_for_habit': 'SELECT name FROM frequency WHERE id = (SELECT frequency_id FROM habit WHERE id = ?)',
+
+    'habit.insert': '''INSERT INTO habit (name, description, frequency_id, startdate, enddate, dateadded)
+                      VALUES (?, ?, ?, ?, ?, ?)''',
+    'habit.get_all': 'SELECT * FROM habit',
+    'habit.get_all_in_range': '''SELECT * FROM habit
+                                WHERE (startdate IS NULL OR startdate < ?)
+                       AND (enddate IS NULL OR enddate = '' OR enddate >= ?)''',
+    'habit.get_many': '''SELECT habit.* FROM temp.query_ids
+                        CROSS JOIN habit ON habit.id = query_ids.id
+                        ORDER BY query_ids.id''',
+    'habit.get_by_frequency': '''SELECT habit.* FROM habit
+                                JOIN frequency ON habit.frequency_id = frequency.id
+                                WHERE frequency.name = ?''',
+    'habit.get_by_frequency_in_range': '''SELECT habit.* FROM habit
+                                JOIN frequency ON habit.frequency_id = frequency.id
+                                WHERE frequency.name = ?
+                                AND (habit.startdate IS NULL OR habit.startdate < ?)
+                                AND (habit.enddate IS NULL OR habit.enddate = '' OR habit.enddate >= ?)''',
+    'habit.count_by_frequency': '''SELECT frequency.name, COUNT(habit.id) FROM frequency
+                                  LEFT JOIN habit ON habit.frequency_id = frequency.id
+                                  GROUP BY frequency.name ORDER BY frequency.name''',
+    'habit.count_by_frequency_in_range': '''SELECT frequency.name, COUNT(habit.id) FROM frequency
+                                  LEFT JOIN habit ON habit.frequency_id = frequency.id
+                                  AND (habit.startdate IS NULL OR habit.startdate < ?)
+                                  AND (habit.enddate IS NULL OR habit.enddate = '' OR habit.enddate >= ?)
+                                  GROUP BY frequency.name ORDER BY frequency.name''',
+    'habit.update': 'UPDATE habit SET name = ?, description = ?, frequency_id = ?, startdate = ?, enddate = ? WHERE id = ?',
+    'habit.delete': 'DELETE FROM habit WHERE id = ?',
+
+    'checkoff.insert': 'INSERT INTO check_off (habit_id, check_date) VALUES (?, ?)',
+    'checkoff.get_all': 'SELECT * FROM check_off ORDER BY id',
+    'checkoff.get_all_in_range': 'SELECT * FROM check_off WHERE check_date >= ? AND check_date < ? ORDER BY id',
+    'checkoff.get_by_habit': 'SELECT * FROM check_off WHERE habit_id = ? ORDER BY id',
+    'checkoff.get_by_habit_in_range': '''SELECT * FROM check_off
+                                        WHERE habit_id = ? AND check_date >= ? AND check_date < ?
+                                        ORDER BY id''',
+    'checkoff.checkdates_for_habit': '''SELECT check_date FROM check_off
+                                       WHERE habit_id = ? AND check_date >= ? AND check_date < ?
+                                       ORDER BY check_date''',
+    'checkoff.checkdates_for_habits': '''SELECT check_off.habit_id, check_off.check_date FROM temp.query_ids
+                                        CROSS JOIN check_off ON check_off.habit_id = query_ids.id
+                                        WHERE check_off.check_date >= ? AND check_off.check_date < ?
+                                        ORDER BY query_ids.id, check_off.check_date''',
+    'checkoff.checkdates_for_habits_active': '''SELECT check_off.habit_id, check_off.check_date FROM temp.query_ids
+                                               CROSS JOIN habit ON habit.id = query_ids.id
+                                               CROSS JOIN check_off ON check_off.habit_id = habit.id
+                                               WHERE check_off.check_date >= max(?, COALESCE(date(habit.startdate), ''))
+                                               AND check_off.check_date < min(?, COALESCE(date(habit.enddate, '+1 day'), ?))
+                                               ORDER BY query_ids.id, check_off.check_date''',
+    'checkoff.update': 'UPDATE check_off SET habit_id = ?, check_date = ? WHERE id = ?',
+    'checkoff.delete': 'DELETE FROM check_off WHERE id = ?',
+    'checkoff.delete_by_habit': 'DELETE FROM check_off WHERE habit_id = ?',
+
+    'export.habits_without_checkoffs': '''SELECT NULL, NULL, habit.id, habit.name, habit.description,
+                                                habit.frequency_id, frequency.name, habit.startdate, habit.enddate, habit.dateadded
+                                         FROM habit
+                                         LEFT JOIN frequency ON frequency.id = habit.frequency_id
+                                         WHERE NOT EXISTS (SELECT 1 FROM check_off WHERE check_off.habit_id = habit.id)
+                                         ORDER BY habit.id''',
+    'export.checkoffs': '''SELECT check_off.id, check_off.check_date, habit.id, habit.name, habit.description,
+                                 habit.frequency_id, frequency.name, habit.startdate, habit.enddate, habit.dateadded
+                          FROM check_off
+                          JOIN habit ON habit.id = check_off.habit_id
+                          LEFT JOIN frequency ON frequency.id = habit.frequency_id
+                          WHERE check_off.id > ?
+                          ORDER BY check_off.id''',
+
+    # Tenant catalog used by ShardedDatabase
+    'catalog.create_shards': 'CREATE TABLE IF NOT EXISTS shard (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)',
+    'catalog.create_tenants': '''CREATE TABLE IF NOT EXISTS tenant (
+                                    tenant_id TEXT PRIMARY KEY,
+                                    shard TEXT NOT NULL,
+                                    db_name TEXT NOT NULL UNIQUE
+                                  )''',
+    'catalog.get_shards': 'SELECT name FROM shard ORDER BY id',
+    'catalog.insert_shard': 'INSERT INTO shard (name) VALUES (?)',
+    'catalog.get_tenant': 'SELECT db_name FROM tenant WHERE tenant_id = ?',
+    'catalog.get_tenants': 'SELECT tenant_id, shard FROM tenant ORDER BY tenant_id',
+    'catalog.insert_tenant': 'INSERT OR IGNORE INTO tenant (tenant_id, shard, db_name) VALUES (?, ?, ?)',
+
+    # Scratch table holding the ids for the batched *_for_ids reads. Queries joining it
+    # use CROSS JOIN to keep it as the outer loop: SQLite has no statistics for it and
+    # would otherwise scan check_off.
+    'ids.create': 'CREATE TEMP TABLE IF NOT EXISTS query_ids (id INTEGER PRIMARY KEY)',
+    'ids.insert': 'INSERT OR IGNORE INTO temp.query_ids (id) VALUES (?)',
+    'ids.clear': 'DELETE FROM temp.query_ids',
+})
+
+
 class Database:
     """
     A utility class for interacting with an SQLite database for habit tracking.
 
     Attributes:
         connection (sqlite3.Connection): The SQLite database connection.
+        lock (threading.RLock): Serializes access to the connection across threads.
     """
 
-    def __init__(self, db_name='test_habits.db'):
+    def __init__(self, db_name='test_habits.db', cached_statements=None):
         """
         Initializes the Database instance and creates tables if they do not exist.
 
         Args:
             db_name (str): The name of the database file. Defaults to 'test_habits.db'.
+            cached_statements (int, optional): The size of the connection's compiled statement
+                cache. Defaults to the larger of sqlite3's default and the number of registered queries.
         """
-        self.connection = sqlite3.connect(db_name)
+        if cached_statements is None:
+            cached_statements = max(DEFAULT_STATEMENT_CACHE_SIZE, len(QUERIES))
+        # The connection may be shared with background threads (e.g. the
+        # buffered check-off writer), so access is serialized through a lock.
+        self.connection = sqlite3.connect(db_name, check_same_thread=False, cached_statements=cached_statements)
+        self.lock = threading.RLock()
         self.create_tables()
         
     def create_tables(self):
@@ -47,6 +226,11 @@ class Database:
                                         check_date DATE NOT NULL,
                                         FOREIGN KEY (habit_id) REFERENCES habit (id)
                                       )''')
+            # Indexes backing the since/until range predicates on check-off reads
+            self.connection.execute('''CREATE INDEX IF NOT EXISTS idx_check_off_habit_date
+                                        ON check_off (habit_id, check_date)''')
+            self.connection.execute('''CREATE INDEX IF NOT EXISTS idx_check_off_date
+                                        ON check_off (check_date)''')
             
     def execute_query(self, query, params=()):
         """
@@ -59,11 +243,26 @@ class Database:
         Returns:
             sqlite3.Cursor: The cursor after executing the query.
         """
-        with self.connection:
+        with self.lock, self.connection:
             cursor = self.connection.execute(query, params)
             self.connection.commit()
         return cursor
 
+    def execute_many(self, query, seq_of_params):
+        """
+        Executes a modifying query once per parameter set in a single transaction.
+
+        Args:
+            query (str): The SQL query to execute.
+            seq_of_params (iterable): The parameter tuples to substitute into the query.
+
+        Returns:
+            sqlite3.Cursor: The cursor after executing the query.
+        """
+        with self.lock, self.connection:
+            cursor = self.connection.executemany(query, seq_of_params)
+        return cursor
+
     def fetch_all(self, query, params=()):
         """
         Executes a query that retrieves multiple rows from the database (SELECT).
@@ -75,9 +274,10 @@ class Database:
         Returns:
             list: A list of tuples containing the rows retrieved.
         """
-        cursor = self.connection.cursor()
-        cursor.execute(query, params)
-        return cursor.fetchall()
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute(query, params)
+            return cursor.fetchall()
 
     def fetch_one(self, query, params=()):
         """
@@ -90,6 +290,305 @@ class Database:
         Returns:
             tuple: A tuple containing the row retrieved, or None if no row was found.
         """
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute(query, params)
+            return cursor.fetchone()
+
+    def fetch_all_for_ids(self, query, ids, params=()):
+        """
+        Executes a SELECT that joins against a set of ids in a single round trip.
+
+        The ids are loaded into the temp table query_ids, which the query joins
+        against, so the SQL text stays the same however many ids are passed.
+
+        Args:
+            query (str): The SQL query to execute; it should join temp.query_ids.
+            ids (iterable): The ids to load into query_ids.
+            params (tuple): The parameters to substitute into the query.
+
+        Returns:
+            list: A list of tuples containing the rows retrieved.
+        """
+        with self.lock, self.connection:
+            self.connection.execute(QUERIES['ids.create'])
+            self.connection.executemany(QUERIES['ids.insert'], ((id_,) for id_ in ids))
+            try:
+                return self.connection.execute(query, params).fetchall()
+            finally:
+                self.connection.execute(QUERIES['ids.clear'])
+
+    def iter_query(self, query, params=(), batch_size=1000):
+        """
+        Executes a SELECT and yields its rows one at a time, fetching batch_size rows
+        per round trip so memory use does not grow with the result size.
+
+        Args:
+            query (str): The SQL query to execute.
+            params (tuple): The parameters to substitute into the query.
+            batch_size (int): The number of rows fetched per round trip. Defaults to 1000.
+
+        Yields:
+            tuple: Each row retrieved.
+        """
         cursor = self.connection.cursor()
-        cursor.execute(query, params)
-        return cursor.fetchone()
+        with self.lock:
+            cursor.execute(query, params)
+        try:
+            while True:
+                with self.lock:
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        with self.lock:
+            self.connection.close()
+
+
+class ShardedDatabase:
+    """
+    Gives every tenant its own SQLite database file, spread across several shard directories.
+
+    A catalog database records the shard directories and which file belongs to
+    each tenant. A new tenant is placed on a shard chosen by a consistent hash
+    ring, and the placement is stored, so later runs (with the same or more
+    shards) always find the tenant's data in the same file. Adding a shard only
+    affects where new tenants are placed; existing tenants are never remapped.
+
+    Tenant files are opened on first use, so a call for one tenant only opens that
+    tenant's file (plus the catalog). Databases returned by for_tenant stay open
+    until close() is called.
+
+    Attributes:
+        catalog_name (str): The file name of the catalog database.
+        replicas (int): The number of points each shard owns on the hash ring.
+        cached_statements (int): The statement cache size of each tenant Database, or None for the default.
+    """
+
+    def __init__(self, catalog_name, shard_names=(), replicas=64, cached_statements=None):
+        """
+        Initializes the ShardedDatabase and loads the catalog.
+
+        Args:
+            catalog_name (str): The file name of the catalog database.
+            shard_names (list, optional): Shard directories to register if the catalog
+                does not have them yet.
+            replicas (int): The number of ring points per shard. Defaults to 64.
+            cached_statements (int, optional): The statement cache size of each tenant Database.
+                Defaults to the Database default.
+        """
+        self.catalog_name = catalog_name
+        self.replicas = replicas
+        self.cached_statements = cached_statements
+        self._lock = threading.RLock()
+        self._catalog = sqlite3.connect(catalog_name, check_same_thread=False)
+        with self._catalog:
+            self._catalog.execute(QUERIES['catalog.create_shards'])
+            self._catalog.execute(QUERIES['catalog.create_tenants'])
+        self._ring = []
+        self._databases = {}
+        for (name,) in self._catalog.execute(QUERIES['catalog.get_shards']).fetchall():
+            self._add_to_ring(name)
+        for name in shard_names:
+            if name not in self.shard_names:
+                self.add_shard(name)
+
+    @classmethod
+    def from_db_name(cls, db_name='test_habits.db', shard_count=None, **kwargs):
+        """
+        Opens the ShardedDatabase whose catalog and shards are derived from a single database name.
+
+        For example 'test_habits.db' uses the catalog 'test_habits_tenants.db' and the shard
+        directories 'test_habits_0', 'test_habits_1', ...
+
+        Args:
+            db_name (str): The base database file name.
+            shard_count (int, optional): The number of shards. Used to create the shards on first
+                use (defaults to DEFAULT_SHARD_COUNT); afterwards it must match the stored shards.
+            **kwargs: Passed to ShardedDatabase, e.g. replicas or cached_statements.
+
+        Returns:
+            ShardedDatabase: The sharded database.
+
+        Raises:
+            ValueError: If shard_count does not match the number of stored shards.
+        """
+        base, ext = os.path.splitext(db_name)
+        sharded = cls(f"{base}_tenants{ext}", **kwargs)
+        if not sharded.shard_names:
+            for i in range(shard_count or DEFAULT_SHARD_COUNT):
+                sharded.add_shard(f"{base}_{i}")
+        elif shard_count is not None and shard_count != len(sharded.shard_names):
+            raise ValueError(f"{sharded.catalog_name} has {len(sharded.shard_names)} shards, not {shard_count}; "
+                             "use add_shard to add shards")
+        return sharded
+
+    @property
+    def shard_names(self):
+        """
+        list: The registered shard directories, in the order they were added.
+        """
+        with self._lock:
+            return [name for (name,) in self._catalog.execute(QUERIES['catalog.get_shards']).fetchall()]
+
+    @staticmethod
+    def _hash(key):
+        """
+        Hashes a key onto the ring. Uses md5 rather than hash() so the placement is the same in every process.
+        """
+        return int.from_bytes(hashlib.md5(str(key).encode('utf-8')).digest()[:8], 'big')
+
+    def _add_to_ring(self, shard_name):
+        for replica in range(self.replicas):
+            bisect.insort(self._ring, (self._hash(f"{shard_name}#{replica}"), shard_name))
+
+    def add_shard(self, shard_name):
+        """
+        Registers a shard directory for placing new tenants.
+
+        Tenants that already have a database file keep it; only tenants placed
+        afterwards can land on the new shard.
+
+        Args:
+            shard_name (str): The directory that will hold the new shard's tenant files.
+
+        Raises:
+            ValueError: If the shard is already registered.
+        """
+        with self._lock:
+            if shard_name in self.shard_names:
+                raise ValueError(f"Shard {shard_name} already exists")
+            with self._catalog:
+                self._catalog.execute(QUERIES['catalog.insert_shard'], (shard_name,))
+            self._add_to_ring(shard_name)
+
+    def placement_for(self, tenant_id):
+        """
+        Returns the shard the hash ring picks for a tenant that has not been placed yet.
+
+        Args:
+            tenant_id: The tenant or user id.
+
+        Returns:
+            str: The shard directory.
+        """
+        index = bisect.bisect(self._ring, (self._hash(tenant_id),))
+        return self._ring[index % len(self._ring)][1]
+
+    def db_name_for(self, tenant_id, create=False):
+        """
+        Returns the database file of a tenant.
+
+        Args:
+            tenant_id: The tenant or user id.
+            create (bool, optional): Whether to place the tenant on a shard if it is new.
+                Defaults to False, so a lookup never registers a tenant.
+
+        Returns:
+            str: The tenant's database file name.
+
+        Raises:
+            KeyError: If the tenant is unknown and create is False.
+            ValueError: If the tenant has to be placed but no shards are registered.
+        """
+        tenant_id = str(tenant_id)
+        with self._lock:
+            row = self._catalog.execute(QUERIES['catalog.get_tenant'], (tenant_id,)).fetchone()
+            if row:
+                return row[0]
+            if not create:
+                raise KeyError(f"Unknown tenant: {tenant_id}")
+            if not self._ring:
+                raise ValueError("ShardedDatabase needs at least one shard")
+            shard_name = self.placement_for(tenant_id)
+            # Keep the tenant id readable in the file name; the hash suffix keeps
+            # ids that differ only in unsafe characters apart.
+            safe_id = re.sub(r'[^A-Za-z0-9_.-]', '_', tenant_id)
+            db_name = os.path.join(shard_name, f"{safe_id}_{self._hash(tenant_id):016x}.db")
+            with self._catalog:
+                self._catalog.execute(QUERIES['catalog.insert_tenant'], (tenant_id, shard_name, db_name))
+            # Another process may have placed the tenant first; its placement wins.
+            return self._catalog.execute(QUERIES['catalog.get_tenant'], (tenant_id,)).fetchone()[0]
+
+    def for_tenant(self, tenant_id, create=False):
+        """
+        Returns the Database holding a tenant's data, opening it on first use.
+
+        Args:
+            tenant_id: The tenant or user id.
+            create (bool, optional): Whether to place the tenant and create its database file
+                if it is new. Defaults to False.
+
+        Returns:
+            Database: The tenant's database.
+
+        Raises:
+            KeyError: If the tenant is unknown and create is False.
+        """
+        db_name = self.db_name_for(tenant_id, create)
+        with self._lock:
+            if db_name not in self._databases:
+                self._databases[db_name] = self._open(db_name)
+            return self._databases[db_name]
+
+    def _open(self, db_name):
+        """
+        Opens a tenant database file, creating its shard directory if needed.
+        """
+        os.makedirs(os.path.dirname(db_name) or '.', exist_ok=True)
+        return Database(db_name, self.cached_statements)
+
+    def tenants(self):
+        """
+        Returns every tenant that has been placed on a shard.
+
+        Returns:
+            list: A list of (tenant id, shard directory) tuples.
+        """
+        with self._lock:
+            return self._catalog.execute(QUERIES['catalog.get_tenants']).fetchall()
+
+    def map_tenants(self, func):
+        """
+        Calls a function on every tenant's database in parallel.
+
+        Each call gets its own connection, closed when the call returns, so a fan-out
+        over many tenants never holds more than MAX_FAN_OUT_WORKERS files open.
+
+        Args:
+            func (callable): Called with each tenant's Database.
+
+        Returns:
+            dict: Maps tenant ids to the function's result for that tenant.
+        """
+        tenant_ids = [tenant_id for tenant_id, _ in self.tenants()]
+        if not tenant_ids:
+            return {}
+
+        def call(tenant_id):
+            db = self._open(self.db_name_for(tenant_id))
+            try:
+                return func(db)
+            finally:
+                db.close()
+
+        with ThreadPoolExecutor(max_workers=min(len(tenant_ids), MAX_FAN_OUT_WORKERS)) as executor:
+            futures = {tenant_id: executor.submit(call, tenant_id) for tenant_id in tenant_ids}
+            return {tenant_id: future.result() for tenant_id, future in futures.items()}
+
+    def close(self):
+        """
+        Closes every tenant database opened by for_tenant and the catalog.
+        """
+        with self._lock:
+            for db in self._databases.values():
+                db.close()
+            self._databases.clear()
+            self._catalog.close()
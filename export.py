@@ -0,0 +1,310 @@
+import csv
+import gzip
+import io
+import itertools
+import json
+import os
+import struct
+import sys
+import time
+from dbutil import QUERIES
+
+# Magic bytes at the start of a columnar export file.
+COLUMNAR_MAGIC = b'HTCOL\x02'
+# Column type codes used in the columnar header and row groups.
+INTEGER, TEXT = 0, 1
+# Range of values that fit an INTEGER block.
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+class HabitExporter:
+    """
+    Streams every habit with its check-offs and frequency to a file.
+
+    There is one row per check-off, joined with its habit and frequency. A full
+    export (since_id=0) first writes one row for each habit that has no check-offs,
+    with checkoff_id and check_date left empty. The check-off rows follow, ordered by
+    check-off id, which doubles as the watermark for incremental exports. Incremental
+    exports only contain check-offs newer than the watermark.
+
+    Rows are read from a cursor in batches, so memory use is bounded by batch_size
+    no matter how much data is exported.
+
+    Supported formats:
+        csv: A header line followed by one line per row.
+        jsonl: One JSON object per row.
+        columnar: A binary format storing each batch column by column. The file starts
+            with COLUMNAR_MAGIC, a uint16 column count and, per column, a uint8 type code
+            and a uint16-length-prefixed UTF-8 name. Each row group is a uint32 row count,
+            then per column a uint8 type code for the block, one null flag byte per row and
+            the values: int64 for INTEGER blocks, uint32-length-prefixed UTF-8 for TEXT
+            blocks. An INTEGER column is written as a TEXT block when the batch holds a value
+            that is not a 64-bit integer (SQLite does not enforce column types). A row count
+            of 0 ends the file. All integers are little-endian.
+
+    Attributes:
+        db (Database): The database instance to read from.
+        batch_size (int): The number of rows fetched and written per batch.
+    """
+
+    FORMATS = ('csv', 'jsonl', 'columnar')
+    COLUMNS = (
+        ('checkoff_id', INTEGER),
+        ('check_date', TEXT),
+        ('habit_id', INTEGER),
+        ('habit_name', TEXT),
+        ('description', TEXT),
+        ('frequency_id', INTEGER),
+        ('frequency_name', TEXT),
+        ('startdate', TEXT),
+        ('enddate', TEXT),
+        ('dateadded', TEXT),
+    )
+
+    def __init__(self, db, batch_size=1000):
+        """
+        Initializes the HabitExporter instance.
+
+        Args:
+            db (Database): The database instance to read from.
+            batch_size (int, optional): The number of rows per batch. Defaults to 1000.
+        """
+        self.db = db
+        self.batch_size = batch_size
+
+    def iter_rows(self, since_id=0):
+        """
+        Yields the export rows: habits without check-offs (full exports only), then check-offs in id order.
+
+        Args:
+            since_id (int, optional): Only check-offs with an id greater than this are returned.
+
+        Yields:
+            tuple: One row with the values listed in COLUMNS.
+        """
+        if not since_id:
+            yield from self.db.iter_query(QUERIES['export.habits_without_checkoffs'], (), self.batch_size)
+        yield from self.db.iter_query(QUERIES['export.checkoffs'], (since_id,), self.batch_size)
+
+    def export(self, out_path='-', fmt='csv', since_id=0, compress=False):
+        """
+        Exports habits and check-offs to a file or to standard output.
+
+        Args:
+            out_path (str, optional): The file to write, or '-' for standard output. Defaults to '-'.
+            fmt (str, optional): One of FORMATS. Defaults to 'csv'.
+            since_id (int, optional): The watermark of the previous export; only later check-offs
+                are exported. Defaults to 0 (everything).
+            compress (bool, optional): Whether to gzip the output. Defaults to False.
+
+        Returns:
+            dict: The number of rows written, the new watermark ('last_id'), the elapsed
+            seconds and the throughput in rows per second.
+
+        Raises:
+            ValueError: If fmt is not a supported format.
+        """
+        # Checked here as well as in write() so a bad format never creates the output file.
+        self._check_format(fmt)
+
+        if out_path == '-':
+            sys.stdout.flush()
+            raw = sys.stdout.buffer
+        else:
+            # Write to a temporary file so a failed export never leaves a truncated file behind.
+            tmp_path = f"{out_path}.tmp"
+            raw = open(tmp_path, 'wb')
+        completed = False
+        out = gzip.GzipFile(fileobj=raw, mode='wb') if compress else raw
+        try:
+            stats = self.write(out, fmt, since_id)
+            completed = True
+            return stats
+        finally:
+            if compress:
+                out.close()
+            if out_path == '-':
+                raw.flush()
+            else:
+                raw.close()
+                if completed:
+                    os.replace(tmp_path, out_path)
+                else:
+                    os.remove(tmp_path)
+
+    def write(self, out, fmt='csv', since_id=0):
+        """
+        Writes habits and check-offs to an open binary file object.
+
+        Args:
+            out (file): A binary file object to write to.
+            fmt (str, optional): One of FORMATS. Defaults to 'csv'.
+            since_id (int, optional): Only check-offs with a greater id are written.
+
+        Returns:
+            dict: See export().
+
+        Raises:
+            ValueError: If fmt is not a supported format.
+        """
+        self._check_format(fmt)
+        started = time.monotonic()
+        stats = {'rows': 0, 'last_id': since_id}
+
+        def counted(rows):
+            for row in rows:
+                stats['rows'] += 1
+                if row[0] is not None:
+                    stats['last_id'] = row[0]
+                yield row
+
+        rows = counted(self.iter_rows(since_id))
+        if fmt == 'columnar':
+            self._write_columnar(out, rows)
+        else:
+            text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+            try:
+                if fmt == 'csv':
+                    self._write_csv(text, rows)
+                else:
+                    self._write_jsonl(text, rows)
+                text.flush()
+            finally:
+                # Leave the underlying stream open for the caller.
+                text.detach()
+
+        stats['seconds'] = time.monotonic() - started
+        stats['rows_per_second'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+        return stats
+
+    def _check_format(self, fmt):
+        """
+        Raises ValueError if fmt is not one of FORMATS.
+        """
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+
+    def _write_csv(self, out, rows):
+        """
+        Writes rows as CSV with a header line.
+
+        Args:
+            out (file): A text file object to write to.
+            rows (iterable): The rows to write, with values in the order of COLUMNS.
+        """
+        writer = csv.writer(out)
+        writer.writerow([name for name, _ in self.COLUMNS])
+        writer.writerows(rows)
+
+    def _write_jsonl(self, out, rows):
+        """
+        Writes rows as JSON lines, one object per row keyed by column name.
+
+        Args:
+            out (file): A text file object to write to.
+            rows (iterable): The rows to write, with values in the order of COLUMNS.
+        """
+        names = [name for name, _ in self.COLUMNS]
+        for row in rows:
+            out.write(json.dumps(dict(zip(names, row)), default=str))
+            out.write('\n')
+
+    def _write_columnar(self, out, rows):
+        """
+        Writes rows in the columnar binary format, one row group per batch_size rows.
+
+        Args:
+            out (file): A binary file object to write to.
+            rows (iterable): The rows to write, with values in the order of COLUMNS.
+        """
+        out.write(COLUMNAR_MAGIC)
+        out.write(struct.pack('<H', len(self.COLUMNS)))
+        for name, column_type in self.COLUMNS:
+            encoded = name.encode('utf-8')
+            out.write(struct.pack('<BH', column_type, len(encoded)))
+            out.write(encoded)
+
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                break
+            out.write(struct.pack('<I', len(batch)))
+            for index, (_, column_type) in enumerate(self.COLUMNS):
+                values = [row[index] for row in batch]
+                if column_type == INTEGER and not all(_is_int64(value) for value in values):
+                    column_type = TEXT
+                out.write(struct.pack('<B', column_type))
+                out.write(bytes(value is None for value in values))
+                if column_type == INTEGER:
+                    out.write(struct.pack(f'<{len(values)}q', *(0 if value is None else value for value in values)))
+                else:
+                    for value in values:
+                        encoded = b'' if value is None else str(value).encode('utf-8')
+                        out.write(struct.pack('<I', len(encoded)))
+                        out.write(encoded)
+        out.write(struct.pack('<I', 0))
+
+
+def _is_int64(value):
+    """
+    Returns whether a value can be stored in an INTEGER block (None counts, as it is stored as a null).
+    """
+    if value is None:
+        return True
+    return isinstance(value, int) and not isinstance(value, bool) and INT64_MIN <= value <= INT64_MAX
+
+
+def read_columnar(fp):
+    """
+    Reads a file written in the columnar export format.
+
+    Args:
+        fp (file): A binary file object positioned at the start of the export.
+
+    Yields:
+        tuple: Each row, with values in the order of the file's columns.
+
+    Raises:
+        ValueError: If the file does not start with COLUMNAR_MAGIC.
+    """
+    columns = read_columnar_header(fp)
+    while True:
+        (count,) = struct.unpack('<I', fp.read(4))
+        if count == 0:
+            return
+        data = []
+        for _ in columns:
+            (column_type,) = struct.unpack('<B', fp.read(1))
+            nulls = fp.read(count)
+            if column_type == INTEGER:
+                values = list(struct.unpack(f'<{count}q', fp.read(8 * count)))
+            else:
+                values = []
+                for _ in range(count):
+                    (length,) = struct.unpack('<I', fp.read(4))
+                    values.append(fp.read(length).decode('utf-8'))
+            data.append([None if is_null else value for is_null, value in zip(nulls, values)])
+        yield from zip(*data)
+
+
+def read_columnar_header(fp):
+    """
+    Reads the header of a columnar export.
+
+    Args:
+        fp (file): A binary file object positioned at the start of the export.
+
+    Returns:
+        list: A list of (column name, type code) tuples.
+
+    Raises:
+        ValueError: If the file does not start with COLUMNAR_MAGIC.
+    """
+    if fp.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar habit export")
+    (column_count,) = struct.unpack('<H', fp.read(2))
+    columns = []
+    for _ in range(column_count):
+        column_type, length = struct.unpack('<BH', fp.read(3))
+        columns.append((fp.read(length).decode('utf-8'), column_type))
+    return columns
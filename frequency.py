@@ -1,3 +1,5 @@
+from dbutil import QUERIES
+
 class Frequency:
     """
     A class to manage the frequency of habits in the habit tracker application.
@@ -22,8 +24,7 @@ class Frequency:
         """
         Saves a new frequency to the database.
         """
-        query = 'INSERT INTO frequency (name) VALUES (?)'
-        self.db.execute_query(query, (self.name,))
+        self.db.execute_query(QUERIES['frequency.insert'], (self.name,))
 
     @staticmethod
     def get_all(db):
@@ -36,8 +37,7 @@ class Frequency:
         Returns:
             list: A list of tuples containing all frequencies.
         """
-        query = 'SELECT * FROM frequency'
-        return db.fetch_all(query)
+        return db.fetch_all(QUERIES['frequency.get_all'])
 
     @staticmethod
     def update(db, frequency_id, name):
@@ -49,8 +49,7 @@ class Frequency:
             frequency_id (int): The ID of the frequency to update.
             name (str): The new name of the frequency.
         """
-        query = 'UPDATE frequency SET name = ? WHERE id = ?'
-        db.execute_query(query, (name, frequency_id))
+        db.execute_query(QUERIES['frequency.update'], (name, frequency_id))
 
     @staticmethod
     def delete(db, frequency_id):
@@ -61,5 +60,4 @@ class Frequency:
             db (Database): The database instance to interact with.
             frequency_id (int): The ID of the frequency to delete.
         """
-        query = 'DELETE FROM frequency WHERE id = ?'
-        db.execute_query(query, (frequency_id,))
+        db.execute_query(QUERIES['frequency.delete'], (frequency_id,))
@@ -1,4 +1,6 @@
 from datetime import datetime, timedelta
+from checkoff import checkdate_bounds
+from dbutil import QUERIES
 
 class Habit:
     """
@@ -38,23 +40,40 @@ class Habit:
         """
         Saves a new habit to the database.
         """
-        query = '''INSERT INTO habit (name, description, frequency_id, startdate, enddate, dateadded) 
-                   VALUES (?, ?, ?, ?, ?, ?)'''
-        self.db.execute_query(query, (self.name, self.description, self.frequency_id, self.startdate, self.enddate, self.dateadded))
+        self.db.execute_query(QUERIES['habit.insert'], (self.name, self.description, self.frequency_id, self.startdate, self.enddate, self.dateadded))
 
     @staticmethod
-    def get_all(db):
+    def get_all(db, since=None, until=None):
         """
-        Retrieves all habits from the database.
+        Retrieves all habits from the database, optionally only those whose active
+        window (startdate to enddate) overlaps a date range.
 
         Args:
             db (Database): The database instance to interact with.
+            since (date or str, optional): The first day of the range.
+            until (date or str, optional): The last day of the range.
 
         Returns:
             list: A list of tuples containing all habits.
         """
-        query = 'SELECT * FROM habit'
-        return db.fetch_all(query)
+        if since is None and until is None:
+            return db.fetch_all(QUERIES['habit.get_all'])
+        lower, upper = checkdate_bounds(since, until)
+        return db.fetch_all(QUERIES['habit.get_all_in_range'], (upper, lower))
+
+    @staticmethod
+    def get_many(db, habit_ids):
+        """
+        Retrieves several habits in a single query.
+
+        Args:
+            db (Database): The database instance to interact with.
+            habit_ids (iterable): The IDs of the habits to retrieve; strings such as '1' are converted to int.
+
+        Returns:
+            list: A list of tuples containing the habits found, ordered by ID.
+        """
+        return db.fetch_all_for_ids(QUERIES['habit.get_many'], [int(habit_id) for habit_id in habit_ids])
 
     @staticmethod
     def update(db, habit_id, name, description, frequency_id, startdate, enddate):
@@ -70,8 +89,7 @@ class Habit:
             startdate (date): The new start date of the habit.
             enddate (date): The new end date of the habit.
         """
-        query = '''UPDATE habit SET name = ?, description = ?, frequency_id = ?, startdate = ?, enddate = ? WHERE id = ?'''
-        db.execute_query(query, (name, description, frequency_id, startdate, enddate, habit_id))
+        db.execute_query(QUERIES['habit.update'], (name, description, frequency_id, startdate, enddate, habit_id))
 
     @staticmethod
     def delete(db, habit_id):
@@ -82,9 +100,7 @@ class Habit:
             db (Database): The database instance to interact with.
             habit_id (int): The ID of the habit to delete.
         """
-        query = 'DELETE FROM habit WHERE id = ?'
-        db.execute_query(query, (habit_id,))
+        db.execute_query(QUERIES['habit.delete'], (habit_id,))
         
         # Also delete associated check-off entries
-        query = 'DELETE FROM check_off WHERE habit_id = ?'
-        db.execute_query(query, (habit_id,))
+        db.execute_query(QUERIES['checkoff.delete_by_habit'], (habit_id,))
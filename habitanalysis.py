@@ -1,7 +1,9 @@
-from dbutil import Database
+import heapq
+from collections import Counter
+from dbutil import QUERIES, Database, ShardedDatabase
 from habit import Habit
 from datetime import datetime, timedelta
-from checkoff import CheckOff
+from checkoff import CheckOff, checkdate_bounds
 
 # Analytics module for the Habit Tracker application
 class HabitAnalysis:
@@ -21,62 +23,140 @@ class HabitAnalysis:
         """
         self.db = db
 
-    def get_all_habits(self):
+    def get_all_habits(self, since=None, until=None):
         """
-        Retrieves all habits from the database.
+        Retrieves all habits from the database, optionally only those active within a date range.
+
+        Args:
+            since (date or str, optional): The first day of the range.
+            until (date or str, optional): The last day of the range.
 
         Returns:
             list: A list of tuples containing all habits.
         """
-        return Habit.get_all(self.db)
+        return Habit.get_all(self.db, since, until)
 
-    def get_habits_by_frequency(self, frequency_name):
+    def get_habits_by_frequency(self, frequency_name, since=None, until=None):
         """
         Retrieves all habits with a specified frequency.
 
         Args:
             frequency_name (str): The name of the frequency (e.g., 'Daily', 'Weekly').
+            since (date or str, optional): Only include habits active on or after this day.
+            until (date or str, optional): Only include habits active on or before this day.
 
         Returns:
             list: A list of tuples containing habits with the specified frequency.
         """
-        query = '''SELECT habit.* FROM habit
-                   JOIN frequency ON habit.frequency_id = frequency.id
-                   WHERE frequency.name = ?'''
-        return self.db.fetch_all(query, (frequency_name,))
+        if since is None and until is None:
+            return self.db.fetch_all(QUERIES['habit.get_by_frequency'], (frequency_name,))
+        lower, upper = checkdate_bounds(since, until)
+        return self.db.fetch_all(QUERIES['habit.get_by_frequency_in_range'], (frequency_name, upper, lower))
 
-    def get_longest_streak(self):
+    def get_longest_streak(self, since=None, until=None, clip_to_active=True):
         """
         Calculates the longest streak across all habits.
 
+        Args:
+            since (date or str, optional): Only count check-offs on or after this day.
+            until (date or str, optional): Only count check-offs on or before this day.
+            clip_to_active (bool, optional): Only count check-offs within each habit's
+                startdate and enddate. Defaults to True.
+
         Returns:
             tuple: A tuple containing the habit with the longest streak and the streak length.
         """
-        habits = self.get_all_habits()
         longest_streak = 0
         longest_streak_habit = None
 
-        for habit in habits:
-            streak = self.get_habit_streak(habit[0], habit[3])
+        for habit, streak in self._habit_streaks(since, until, clip_to_active):
             if streak > longest_streak:
                 longest_streak = streak
                 longest_streak_habit = habit
 
         return longest_streak_habit, longest_streak
 
-    def get_habit_streak(self, habit_id, frequency_id):
+    def get_leaderboard(self, limit=10, since=None, until=None, clip_to_active=True):
+        """
+        Ranks habits by their longest streak.
+
+        Args:
+            limit (int): The maximum number of habits to return. Defaults to 10.
+            since (date or str, optional): Only count check-offs on or after this day.
+            until (date or str, optional): Only count check-offs on or before this day.
+            clip_to_active (bool, optional): Only count check-offs within each habit's
+                startdate and enddate. Defaults to True.
+
+        Returns:
+            list: A list of (habit, streak) tuples, longest streak first.
+        """
+        streaks = self._habit_streaks(since, until, clip_to_active)
+        return heapq.nlargest(limit, streaks, key=lambda entry: entry[1])
+
+    def count_habits_by_frequency(self, since=None, until=None):
+        """
+        Counts the habits for each frequency.
+
+        Args:
+            since (date or str, optional): Only count habits active on or after this day.
+            until (date or str, optional): Only count habits active on or before this day.
+
+        Returns:
+            list: A list of (frequency name, habit count) tuples.
+        """
+        if since is None and until is None:
+            return self.db.fetch_all(QUERIES['habit.count_by_frequency'])
+        lower, upper = checkdate_bounds(since, until)
+        return self.db.fetch_all(QUERIES['habit.count_by_frequency_in_range'], (upper, lower))
+
+    def get_habit_streak(self, habit_id, frequency_id, since=None, until=None, clip_to_active=True):
         """
         Calculates the longest streak for a specified habit.
 
         Args:
             habit_id (int): The ID of the habit.
             frequency_id (int): The ID of the frequency associated with the habit.
+            since (date or str, optional): Only count check-offs on or after this day.
+            until (date or str, optional): Only count check-offs on or before this day.
+            clip_to_active (bool, optional): Only count check-offs within the habit's
+                startdate and enddate. Defaults to True.
 
         Returns:
             int: The longest streak length for the specified habit.
         """
-        check_dates = CheckOff.get_checkdates_for_habit(self.db, habit_id)
+        if clip_to_active:
+            # Same query as the leaderboard, so both apply the active window identically.
+            check_dates = CheckOff.get_checkdates_for_habits(self.db, [habit_id], since, until,
+                                                           clip_to_active=True)[int(habit_id)]
+        else:
+            check_dates = CheckOff.get_checkdates_for_habit(self.db, habit_id, since, until)
+        return self._calculate_streak(check_dates, frequency_id)
+
+    def _habit_streaks(self, since, until, clip_to_active):
+        """
+        Yields (habit, streak) for every habit active within the date range.
+
+        The check-off dates of all habits are read in one query, bounded by each
+        habit's active window when clip_to_active is set.
+        """
+        habits = self.get_all_habits(since, until)
+        habit_ids = [habit[0] for habit in habits]
+        check_dates = CheckOff.get_checkdates_for_habits(self.db, habit_ids, since, until, clip_to_active)
+        for habit in habits:
+            yield habit, self._calculate_streak(check_dates[habit[0]], habit[3])
+
+    @staticmethod
+    def _calculate_streak(check_dates, frequency_id):
+        """
+        Calculates the longest run of consecutive check-off dates.
+
+        Args:
+            check_dates (list): The check-off dates, in order.
+            frequency_id (int): The ID of the frequency associated with the habit.
 
+        Returns:
+            int: The longest streak length.
+        """
         if not check_dates:
             return 0
 
@@ -102,3 +182,75 @@ class HabitAnalysis:
                     streak = 1
 
         return max_streak
+
+
+class ShardedHabitAnalysis:
+    """
+    Runs habit analytics across every tenant of a ShardedDatabase and merges the results.
+
+    Attributes:
+        sharded_db (ShardedDatabase): The sharded database to analyse.
+    """
+
+    def __init__(self, sharded_db: ShardedDatabase):
+        """
+        Initializes the ShardedHabitAnalysis instance.
+
+        Args:
+            sharded_db (ShardedDatabase): The sharded database to analyse.
+        """
+        self.sharded_db = sharded_db
+
+    def get_leaderboard(self, limit=10, since=None, until=None, clip_to_active=True):
+        """
+        Ranks habits from all tenants by their longest streak.
+
+        Each tenant's database computes its own top entries in parallel; only those are merged.
+
+        Args:
+            limit (int): The maximum number of habits to return. Defaults to 10.
+            since (date or str, optional): Only count check-offs on or after this day.
+            until (date or str, optional): Only count check-offs on or before this day.
+            clip_to_active (bool, optional): Only count check-offs within each habit's
+                startdate and enddate. Defaults to True.
+
+        Returns:
+            list: A list of (tenant id, habit, streak) tuples, longest streak first.
+        """
+        results = self.sharded_db.map_tenants(lambda db: HabitAnalysis(db).get_leaderboard(limit, since, until, clip_to_active))
+        entries = ((tenant, habit, streak) for tenant, board in results.items() for habit, streak in board)
+        return heapq.nlargest(limit, entries, key=lambda entry: entry[2])
+
+    def get_longest_streak(self, since=None, until=None, clip_to_active=True):
+        """
+        Finds the habit with the longest streak across all tenants.
+
+        Args:
+            since (date or str, optional): Only count check-offs on or after this day.
+            until (date or str, optional): Only count check-offs on or before this day.
+            clip_to_active (bool, optional): Only count check-offs within each habit's
+                startdate and enddate. Defaults to True.
+
+        Returns:
+            tuple: A tuple containing the tenant id, the habit and the streak length.
+        """
+        leaderboard = self.get_leaderboard(1, since, until, clip_to_active)
+        return leaderboard[0] if leaderboard else (None, None, 0)
+
+    def count_habits_by_frequency(self, since=None, until=None):
+        """
+        Counts the habits for each frequency across all tenants.
+
+        Args:
+            since (date or str, optional): Only count habits active on or after this day.
+            until (date or str, optional): Only count habits active on or before this day.
+
+        Returns:
+            list: A list of (frequency name, habit count) tuples.
+        """
+        results = self.sharded_db.map_tenants(lambda db: HabitAnalysis(db).count_habits_by_frequency(since, until))
+        totals = Counter()
+        for rows in results.values():
+            for name, count in rows:
+                totals[name] += count
+        return sorted(totals.items())
@@ -1,26 +1,101 @@
+import sys
 import fire
-from dbutil import Database
+from dbutil import QUERIES, Database, ShardedDatabase
 from habit import Habit
 from frequency import Frequency
 from checkoff import CheckOff
-from habitanalysis import HabitAnalysis
+from export import HabitExporter
+from habitanalysis import HabitAnalysis, ShardedHabitAnalysis
 
 class ManageDB:
     """
     A class to manage the database operations for the Habit Tracker application.
     
     Attributes:
-        db (Database): The database instance to interact with.
+        db (Database): The database instance to interact with; for a tenant it is set by the first command.
+        shards (ShardedDatabase): The sharded database, or None when not running per tenant.
     """
 
-    def __init__(self, db_name='test_habits.db'):
+    def __init__(self, db_name='test_habits.db', tenant=None, shard_count=None, cached_statements=None):
         """
         Initializes the ManageDB instance with a database connection.
+
+        When a tenant is given, every command runs against that tenant's own database
+        file, which is placed in one of the shard directories derived from db_name
+        (see ShardedDatabase.from_db_name). A new tenant is only placed by add_tenant or
+        by its first add_* command; other commands on an unknown tenant fail.
         
         Args:
             db_name (str): The name of the database file.
+            tenant (str, optional): The tenant or user id to route commands to.
+            shard_count (int, optional): The number of shards created on first use with --tenant.
+                Defaults to 4; afterwards it must match the stored shards.
+            cached_statements (int, optional): The size of each connection's compiled statement cache.
+        """
+        self.db_name = db_name
+        self.tenant = tenant
+        self.shard_count = shard_count
+        self.cached_statements = cached_statements
+        if tenant is None:
+            self.shards = None
+            self.db = Database(db_name, cached_statements)
+        else:
+            self.shards = ShardedDatabase.from_db_name(db_name, shard_count, cached_statements=cached_statements)
+            # Looked up by the first command, so reading an unknown tenant never places it.
+            self.db = None
+
+    def _get_db(self, create=False):
+        """
+        Returns the database commands run against, looking the tenant up on first use.
+
+        Args:
+            create (bool, optional): Whether to place the tenant if it is new. Only commands
+                that add data pass True.
+
+        Raises:
+            KeyError: If the tenant is unknown and create is False.
+        """
+        if self.db is None:
+            self.db = self.shards.for_tenant(self.tenant, create)
+        return self.db
+
+    # Shard Management
+
+    def _sharded_db(self):
+        """
+        Returns the ShardedDatabase for db_name, opening it if no tenant was given.
+        """
+        if self.shards is None:
+            self.shards = ShardedDatabase.from_db_name(self.db_name, self.shard_count,
+                                                       cached_statements=self.cached_statements)
+        return self.shards
+
+    def add_shard(self, shard_name):
+        """
+        Adds a shard directory for placing new tenants. Existing tenants keep their files.
+
+        Args:
+            shard_name (str): The directory for the new shard.
+        """
+        self._sharded_db().add_shard(shard_name)
+        print(f"Added shard: {shard_name}")
+
+    def add_tenant(self, tenant_id):
+        """
+        Places a new tenant on a shard and creates its database file.
+
+        Args:
+            tenant_id (str): The tenant or user id.
+        """
+        self._sharded_db().for_tenant(tenant_id, create=True)
+        print(f"Added tenant: {tenant_id}")
+
+    def list_tenants(self):
+        """
+        Lists every tenant and the shard holding its database.
         """
-        self.db = Database(db_name)
+        for tenant_id, shard_name in self._sharded_db().tenants():
+            print(f"{tenant_id}: {shard_name}")
     
     # Frequency Management
 
@@ -31,7 +106,7 @@ class ManageDB:
         Args:
             name (str): The name of the frequency.
         """
-        frequency = Frequency(self.db, name)
+        frequency = Frequency(self._get_db(create=True), name)
         frequency.save()
         print(f"Added frequency: {name}")
     
@@ -43,7 +118,7 @@ class ManageDB:
             frequency_id (int): The ID of the frequency to update.
             name (str): The new name of the frequency.
         """
-        Frequency.update(self.db, frequency_id, name)
+        Frequency.update(self._get_db(), frequency_id, name)
         print(f"Updated frequency {frequency_id} to {name}")
     
     def delete_frequency(self, frequency_id):
@@ -53,14 +128,14 @@ class ManageDB:
         Args:
             frequency_id (int): The ID of the frequency to delete.
         """
-        Frequency.delete(self.db, frequency_id)
+        Frequency.delete(self._get_db(), frequency_id)
         print(f"Deleted frequency {frequency_id}")
     
     def list_frequencies(self):
         """
         Lists all frequencies in the database.
         """
-        frequencies = Frequency.get_all(self.db)
+        frequencies = Frequency.get_all(self._get_db())
         for freq in frequencies:
             print(freq)
 
@@ -77,7 +152,7 @@ class ManageDB:
             startdate (str): The start date of the habit (optional).
             enddate (str): The end date of the habit (optional).
         """
-        habit = Habit(self.db, name, description, frequency_id, startdate, enddate)
+        habit = Habit(self._get_db(create=True), name, description, frequency_id, startdate, enddate)
         habit.save()
         print(f"Added habit: {name}")
     
@@ -93,7 +168,7 @@ class ManageDB:
             startdate (str): The new start date of the habit (optional).
             enddate (str): The new end date of the habit (optional).
         """
-        Habit.update(self.db, habit_id, name, description, frequency_id, startdate, enddate)
+        Habit.update(self._get_db(), habit_id, name, description, frequency_id, startdate, enddate)
         print(f"Updated habit {habit_id}")
     
     def delete_habit(self, habit_id):
@@ -103,14 +178,18 @@ class ManageDB:
         Args:
             habit_id (int): The ID of the habit to delete.
         """
-        Habit.delete(self.db, habit_id)
+        Habit.delete(self._get_db(), habit_id)
         print(f"Deleted habit {habit_id}")
     
-    def list_habits(self):
+    def list_habits(self, since=None, until=None):
         """
         Lists all habits in the database.
+
+        Args:
+            since (str): Only include habits active on or after this day (YYYY-MM-DD).
+            until (str): Only include habits active on or before this day (YYYY-MM-DD).
         """
-        habits = Habit.get_all(self.db)
+        habits = Habit.get_all(self._get_db(), since, until)
         for habit in habits:
             print(habit)
 
@@ -124,7 +203,7 @@ class ManageDB:
             habit_id (int): The ID of the habit.
             check_date (str): The date of the checkoff.
         """
-        checkoff = CheckOff(self.db, habit_id, check_date)
+        checkoff = CheckOff(self._get_db(create=True), habit_id, check_date)
         checkoff.save()
         print(f"Added checkoff for habit {habit_id} on {check_date}")
     
@@ -137,7 +216,7 @@ class ManageDB:
             habit_id (int): The ID of the habit.
             check_date (str): The new date of the checkoff.
         """
-        CheckOff.update(self.db, checkoff_id, habit_id, check_date)
+        CheckOff.update(self._get_db(), checkoff_id, habit_id, check_date)
         print(f"Updated checkoff {checkoff_id}")
     
     def delete_checkoff(self, checkoff_id):
@@ -147,70 +226,141 @@ class ManageDB:
         Args:
             checkoff_id (int): The ID of the checkoff to delete.
         """
-        CheckOff.delete(self.db, checkoff_id)
+        CheckOff.delete(self._get_db(), checkoff_id)
         print(f"Deleted checkoff {checkoff_id}")
     
-    def list_checkoffs(self):
+    def list_checkoffs(self, since=None, until=None):
         """
         Lists all checkoffs in the database.
+
+        Args:
+            since (str): Only include check-offs on or after this day (YYYY-MM-DD).
+            until (str): Only include check-offs on or before this day (YYYY-MM-DD).
         """
-        checkoffs = CheckOff.get_all(self.db)
+        checkoffs = CheckOff.get_all(self._get_db(), since, until)
         for checkoff in checkoffs:
             print(checkoff)
 
-    def list_checkoffs_by_habit(self, habit_id):
+    def list_checkoffs_by_habit(self, habit_id, since=None, until=None):
         """
         Lists all checkoffs for a specific habit.
         
         Args:
             habit_id (int): The ID of the habit.
+            since (str): Only include check-offs on or after this day (YYYY-MM-DD).
+            until (str): Only include check-offs on or before this day (YYYY-MM-DD).
         """
-        checkoffs = CheckOff.get_by_habit(self.db, habit_id)
+        checkoffs = CheckOff.get_by_habit(self._get_db(), habit_id, since, until)
         for checkoff in checkoffs:
             print(checkoff)
 
+    # Export
+
+    def export(self, out_path='-', fmt='csv', since_id=0, compress=False, batch_size=1000):
+        """
+        Streams every habit with its check-offs and frequency.
+
+        Throughput and the watermark for the next incremental export are reported on stderr.
+
+        Args:
+            out_path (str): The file to write, or '-' for standard output.
+            fmt (str): The output format: 'csv', 'jsonl' or 'columnar'.
+            since_id (int): Only export check-offs with an id greater than this watermark.
+            compress (bool): Whether to gzip the output.
+            batch_size (int): The number of rows read per round trip.
+        """
+        exporter = HabitExporter(self._get_db(), batch_size)
+        stats = exporter.export(out_path, fmt, since_id, compress)
+        print(f"Exported {stats['rows']} checkoffs in {stats['seconds']:.2f}s "
+              f"({stats['rows_per_second']:.0f} rows/s), last checkoff id: {stats['last_id']}", file=sys.stderr)
+
     # Analysis Functions
 
-    def get_all_habits(self):
+    def get_all_habits(self, since=None, until=None):
         """
         Lists all currently tracked habits.
+
+        Args:
+            since (str): Only include habits active on or after this day (YYYY-MM-DD).
+            until (str): Only include habits active on or before this day (YYYY-MM-DD).
         """
-        habit_analysis = HabitAnalysis(self.db)
-        habits = habit_analysis.get_all_habits()
+        habit_analysis = HabitAnalysis(self._get_db())
+        habits = habit_analysis.get_all_habits(since, until)
         for habit in habits:
             print(habit)
 
-    def get_habits_by_frequency(self, frequency_name):
+    def get_habits_by_frequency(self, frequency_name, since=None, until=None):
         """
         Lists all habits with a specified frequency.
         
         Args:
             frequency_name (str): The name of the frequency (e.g., 'Daily', 'Weekly').
+            since (str): Only include habits active on or after this day (YYYY-MM-DD).
+            until (str): Only include habits active on or before this day (YYYY-MM-DD).
         """
-        habit_analysis = HabitAnalysis(self.db)
-        habits = habit_analysis.get_habits_by_frequency(frequency_name)
+        habit_analysis = HabitAnalysis(self._get_db())
+        habits = habit_analysis.get_habits_by_frequency(frequency_name, since, until)
         for habit in habits:
             print(habit)
 
-    def get_longest_streak(self):
+    def get_longest_streak(self, since=None, until=None):
         """
         Retrieves the habit with the longest streak.
+
+        Args:
+            since (str): Only include check-offs on or after this day (YYYY-MM-DD).
+            until (str): Only include check-offs on or before this day (YYYY-MM-DD).
         """
-        habit_analysis = HabitAnalysis(self.db)
-        habit, streak = habit_analysis.get_longest_streak()
+        habit_analysis = HabitAnalysis(self._get_db())
+        habit, streak = habit_analysis.get_longest_streak(since, until)
         print(f"Longest Streak Habit: {habit}")
         print(f"Longest Streak Length: {streak}")
 
-    def get_habit_streak(self, habit_id):
+    def get_leaderboard(self, limit=10, since=None, until=None):
+        """
+        Lists the habits with the longest streaks. With --tenant the leaderboard
+        covers every tenant.
+
+        Args:
+            limit (int): The maximum number of habits to list.
+            since (str): Only include check-offs on or after this day (YYYY-MM-DD).
+            until (str): Only include check-offs on or before this day (YYYY-MM-DD).
+        """
+        if self.shards is None:
+            for habit, streak in HabitAnalysis(self._get_db()).get_leaderboard(limit, since, until):
+                print(f"{streak}: {habit}")
+        else:
+            for tenant_id, habit, streak in ShardedHabitAnalysis(self.shards).get_leaderboard(limit, since, until):
+                print(f"{streak}: {habit} [{tenant_id}]")
+
+    def count_habits_by_frequency(self, since=None, until=None):
+        """
+        Lists the number of habits for each frequency. With --tenant the counts
+        cover every tenant.
+
+        Args:
+            since (str): Only count habits active on or after this day (YYYY-MM-DD).
+            until (str): Only count habits active on or before this day (YYYY-MM-DD).
+        """
+        if self.shards is None:
+            counts = HabitAnalysis(self._get_db()).count_habits_by_frequency(since, until)
+        else:
+            counts = ShardedHabitAnalysis(self.shards).count_habits_by_frequency(since, until)
+        for frequency_name, count in counts:
+            print(f"{frequency_name}: {count}")
+
+    def get_habit_streak(self, habit_id, since=None, until=None):
         """
         Retrieves the streak for a specific habit.
         
         Args:
             habit_id (int): The ID of the habit.
+            since (str): Only include check-offs on or after this day (YYYY-MM-DD).
+            until (str): Only include check-offs on or before this day (YYYY-MM-DD).
         """
-        habit_analysis = HabitAnalysis(self.db)
-        frequency_name = self.db.fetch_one('SELECT name FROM frequency WHERE id = (SELECT frequency_id FROM habit WHERE id = ?)', (habit_id,))[0]
-        streak = habit_analysis.get_habit_streak(habit_id, frequency_name)
+        habit_analysis = HabitAnalysis(self._get_db())
+        frequency_name = self._get_db().fetch_one(QUERIES['frequency.name_for_habit'], (habit_id,))[0]
+        streak = habit_analysis.get_habit_streak(habit_id, frequency_name, since, until)
         print(f"Longest Streak for Habit {habit_id} ({frequency_name}): {streak}")
 
 if __name__ == '__main__':
@@ -1,9 +1,20 @@
+import csv
+import io
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
-from dbutil import Database
+from dbutil import QUERIES, Database, ShardedDatabase
 from habit import Habit
 from frequency import Frequency
 from checkoff import CheckOff
-from habitanalysis import HabitAnalysis
+from habitanalysis import HabitAnalysis, ShardedHabitAnalysis
+from checkoffwriter import BufferedCheckOffWriter
+from export import HabitExporter, read_columnar
 from datetime import datetime
 
 # Test Suite for habits. Analysis methods are tested against the test data, destructive tests use a temporary database
@@ -70,5 +81,372 @@ class TestDatabase(unittest.TestCase):
         result = self.tempdb.fetch_one("SELECT * FROM habit WHERE id = ?", (habit_id,))
         self.assertIsNone(result)
 
+    # Test buffered check-off writer using a fresh in-memory DB
+    def test_buffered_writer_group_commit(self):
+        """Test that check-offs from several threads are written in deduplicated batches."""
+        db = Database(db_name=':memory:')
+        writer = BufferedCheckOffWriter(db, batch_size=50, flush_interval=0.01)
+        futures = []
+        lock = threading.Lock()
+
+        def submit(habit_id):
+            for day in range(1, 21):
+                future = writer.add(habit_id, f'2024-01-{day:02d} 00:00:00')
+                with lock:
+                    futures.append(future)
+
+        threads = [threading.Thread(target=submit, args=(habit_id,)) for habit_id in (1, 2, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for future in futures:
+            future.result(timeout=5)
+        writer.close()
+
+        count = db.fetch_one("SELECT COUNT(*) FROM check_off")[0]
+        metrics = writer.metrics()
+        self.assertEqual(count + metrics['deduplicated'], 60)
+        self.assertEqual(metrics['written'], count)
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertGreaterEqual(metrics['flushes'], 1)
+
+    # Test the writer keeps running when a caller tries to cancel its future
+    def test_buffered_writer_survives_cancel(self):
+        """Test that cancelling a returned future does not stop the background thread."""
+        db = Database(db_name=':memory:')
+        with BufferedCheckOffWriter(db, batch_size=10, flush_interval=0.01) as writer:
+            first = writer.add(1, '2024-03-01 00:00:00')
+            self.assertFalse(first.cancel())
+            first.result(timeout=5)
+            second = writer.add(1, '2024-03-02 00:00:00')
+            second.result(timeout=5)
+        self.assertEqual(db.fetch_one("SELECT COUNT(*) FROM check_off")[0], 2)
+
+    # Test check-offs accepted while the writer is closing are still written
+    def test_buffered_writer_close_race(self):
+        """Test that every check-off accepted by add() is written when close() runs concurrently."""
+        db = Database(db_name=':memory:')
+        writer = BufferedCheckOffWriter(db, batch_size=20, flush_interval=0.01)
+        futures = []
+        lock = threading.Lock()
+
+        def submit(habit_id):
+            for day in range(1, 10000):
+                try:
+                    future = writer.add(habit_id, f'day {day}')
+                except RuntimeError:
+                    return
+                with lock:
+                    futures.append(future)
+
+        threads = [threading.Thread(target=submit, args=(habit_id,)) for habit_id in (1, 2, 3)]
+        for thread in threads:
+            thread.start()
+        writer.close()
+        for thread in threads:
+            thread.join()
+
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual(db.fetch_one("SELECT COUNT(*) FROM check_off")[0], len(futures))
+
+    # Test a producer blocked on a full queue does not hold up the others
+    def test_buffered_writer_full_queue_timeout(self):
+        """Test that add() with a timeout raises queue.Full on time while another producer is blocked."""
+        class StalledDatabase:
+            def __init__(self):
+                self.entered = threading.Event()
+                self.release = threading.Event()
+                self.rows = []
+
+            def execute_many(self, query, seq_of_params):
+                self.entered.set()
+                self.release.wait(5)
+                self.rows.extend(seq_of_params)
+
+        db = StalledDatabase()
+        writer = BufferedCheckOffWriter(db, batch_size=1, max_queue_size=1)
+        futures = [writer.add(1, 'day 1')]
+        self.assertTrue(db.entered.wait(5))
+        futures.append(writer.add(1, 'day 2'))
+        blocked = threading.Thread(target=lambda: futures.append(writer.add(1, 'day 3')))
+        blocked.start()
+
+        started = time.monotonic()
+        with self.assertRaises(queue.Full):
+            writer.add(1, 'day 4', timeout=0.2)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+        closer = threading.Thread(target=writer.close)
+        closer.start()
+        db.release.set()
+        closer.join(5)
+        blocked.join(5)
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual(db.rows, [(1, 'day 1'), (1, 'day 2'), (1, 'day 3')])
+
+    # Test fire-and-forget check-offs are written on shutdown
+    def test_buffered_writer_flushes_on_close(self):
+        """Test that fire-and-forget check-offs are committed when the writer closes."""
+        db = Database(db_name=':memory:')
+        with BufferedCheckOffWriter(db, batch_size=1000, flush_interval=60, wait_for_flush=False) as writer:
+            for day in range(1, 11):
+                self.assertIsNone(writer.add(1, f'2024-02-{day:02d} 00:00:00'))
+        count = db.fetch_one("SELECT COUNT(*) FROM check_off WHERE habit_id = ?", (1,))[0]
+        self.assertEqual(count, 10)
+
+    # Test tenant placement using a temporary catalog and shard directories
+    def test_sharded_placement_is_stored(self):
+        """Test that tenant placements survive reopening and adding a shard, and only one tenant file is opened."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_name = os.path.join(tmpdir, 'habits.db')
+            sharded = ShardedDatabase.from_db_name(db_name, 3)
+            tenants = [f'tenant-{i}' for i in range(50)]
+            before = {tenant: sharded.db_name_for(tenant, create=True) for tenant in tenants}
+            self.assertEqual(len(set(before.values())), 50)
+            self.assertEqual(len({os.path.dirname(name) for name in before.values()}), 3)
+
+            sharded.for_tenant('tenant-0')
+            self.assertEqual([name for name in before.values() if os.path.exists(name)], [before['tenant-0']])
+
+            reopened = ShardedDatabase.from_db_name(db_name)
+            reopened.add_shard(os.path.join(tmpdir, 'habits_3'))
+            self.assertEqual(before, {tenant: reopened.db_name_for(tenant) for tenant in tenants})
+            with self.assertRaises(ValueError):
+                ShardedDatabase.from_db_name(db_name, 3)
+
+    # Test looking up an unknown tenant does not place it
+    def test_sharded_lookup_does_not_place(self):
+        """Test that reading an unknown tenant raises KeyError without registering it or creating its file."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sharded = ShardedDatabase.from_db_name(os.path.join(tmpdir, 'habits.db'), 2)
+            with self.assertRaises(KeyError):
+                sharded.for_tenant('acme')
+            with self.assertRaises(KeyError):
+                sharded.db_name_for('acme')
+            self.assertEqual(sharded.tenants(), [])
+            self.assertFalse(any(files for _, _, files in os.walk(sharded.placement_for('acme'))))
+
+            db_name = sharded.db_name_for('acme', create=True)
+            self.assertIs(sharded.for_tenant('acme'), sharded.for_tenant('acme', create=True))
+            self.assertTrue(os.path.exists(db_name))
+            self.assertEqual([tenant for tenant, _ in sharded.tenants()], ['acme'])
+
+    # Test tenants placed on the same shard cannot see each other's data
+    def test_sharded_tenants_isolated(self):
+        """Test that two tenants on the same shard keep separate habits."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sharded = ShardedDatabase.from_db_name(os.path.join(tmpdir, 'habits.db'), 1)
+            self.assertEqual(sharded.placement_for('acme'), sharded.placement_for('umbrella'))
+            Habit(sharded.for_tenant('acme', create=True), 'AcmeSecret', 'Test Description', 1, '', '').save()
+            self.assertEqual(Habit.get_all(sharded.for_tenant('umbrella', create=True)), [])
+            self.assertEqual(len(Habit.get_all(sharded.for_tenant('acme'))), 1)
+
+    # Test cross-tenant analytics using a temporary catalog and shard directories
+    def test_sharded_analysis(self):
+        """Test that cross-tenant analytics merge results from every tenant."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sharded = ShardedDatabase.from_db_name(os.path.join(tmpdir, 'habits.db'), 2)
+            for index, tenant in enumerate(('acme', 'umbrella')):
+                db = sharded.for_tenant(tenant, create=True)
+                Frequency(db, 'Daily').save()
+                Frequency(db, 'Weekly').save()
+                Habit(db, f'Habit {index}', 'Test Description', 1, '', '').save()
+                for day in range(1, index + 3):
+                    CheckOff(db, 1, f'2024-01-{day:02d} 00:00:00').save()
+
+            analysis = ShardedHabitAnalysis(sharded)
+            self.assertEqual(analysis.count_habits_by_frequency(), [('Daily', 2), ('Weekly', 0)])
+            leaderboard = analysis.get_leaderboard()
+            self.assertEqual([(tenant, streak) for tenant, _, streak in leaderboard], [('umbrella', 3), ('acme', 2)])
+            self.assertEqual(leaderboard[0][1][1], 'Habit 1')
+
+    # Test fan-out and close() release tenant connections
+    def test_sharded_connections_closed(self):
+        """Test that map_tenants closes the connection it opened per tenant and close() closes the rest."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sharded = ShardedDatabase.from_db_name(os.path.join(tmpdir, 'habits.db'), 2)
+            for tenant in ('acme', 'umbrella'):
+                sharded.for_tenant(tenant, create=True)
+            opened = sharded.for_tenant('acme')
+
+            seen = []
+            sharded.map_tenants(seen.append)
+            self.assertEqual(len(seen), 2)
+            for db in seen:
+                self.assertIsNot(db, opened)
+                with self.assertRaises(sqlite3.ProgrammingError):
+                    db.fetch_one("SELECT 1")
+
+            self.assertEqual(opened.fetch_one("SELECT 1"), (1,))
+            sharded.close()
+            with self.assertRaises(sqlite3.ProgrammingError):
+                opened.fetch_one("SELECT 1")
+
+    # Test CSV export from DB
+    def test_export_csv(self):
+        """Test that the CSV export contains every check-off and reports the watermark"""
+        out = io.BytesIO()
+        stats = HabitExporter(self.db, batch_size=50).write(out, 'csv')
+        rows = list(csv.reader(io.StringIO(out.getvalue().decode('utf-8'))))
+        total, last_id = self.db.fetch_one("SELECT COUNT(*), MAX(id) FROM check_off")
+        self.assertEqual(rows[0][:3], ['checkoff_id', 'check_date', 'habit_id'])
+        self.assertEqual(len(rows) - 1, total)
+        self.assertEqual(stats['rows'], total)
+        self.assertEqual(stats['last_id'], last_id)
+
+    # Test an unknown export format is rejected
+    def test_export_unknown_format(self):
+        """Test that write() and export() reject an unsupported format without writing anything"""
+        out = io.BytesIO()
+        with self.assertRaises(ValueError):
+            HabitExporter(self.db).write(out, 'xml')
+        self.assertEqual(out.getvalue(), b'')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(ValueError):
+                HabitExporter(self.db).export(os.path.join(tmpdir, 'habits.xml'), 'xml')
+            self.assertEqual(os.listdir(tmpdir), [])
+
+    # Test habits without check-offs are exported using a fresh in-memory DB
+    def test_export_includes_habits_without_checkoffs(self):
+        """Test that a full export lists habits with no check-offs and incremental exports skip them"""
+        db = Database(db_name=':memory:')
+        Frequency(db, 'Daily').save()
+        Habit(db, 'Unchecked', 'Test Description', 1, '', '').save()
+        Habit(db, 'Checked', 'Test Description', 1, '', '').save()
+        CheckOff(db, 2, '2024-01-01 00:00:00').save()
+
+        out = io.BytesIO()
+        stats = HabitExporter(db).write(out, 'jsonl')
+        rows = [json.loads(line) for line in out.getvalue().decode('utf-8').splitlines()]
+        self.assertEqual([(row['checkoff_id'], row['habit_name']) for row in rows], [(None, 'Unchecked'), (1, 'Checked')])
+        self.assertEqual(stats['last_id'], 1)
+
+        CheckOff(db, 2, '2024-01-02 00:00:00').save()
+        out = io.BytesIO()
+        stats = HabitExporter(db).write(out, 'jsonl', since_id=stats['last_id'])
+        rows = [json.loads(line) for line in out.getvalue().decode('utf-8').splitlines()]
+        self.assertEqual([(row['checkoff_id'], row['habit_name']) for row in rows], [(2, 'Checked')])
+        self.assertEqual(stats['last_id'], 2)
+
+    # Test columnar export of non-integer values in an integer column using a fresh in-memory DB
+    def test_export_columnar_text_in_integer_column(self):
+        """Test that a text frequency_id is exported as text instead of aborting the columnar file"""
+        db = Database(db_name=':memory:')
+        Habit(db, 'Text Frequency', 'Test Description', 'Daily', '', '').save()
+        CheckOff(db, 1, '2024-01-01 00:00:00').save()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            out_path = os.path.join(tmpdir, 'export.bin')
+            HabitExporter(db).export(out_path, 'columnar')
+            self.assertEqual(os.listdir(tmpdir), ['export.bin'])
+            with open(out_path, 'rb') as fp:
+                rows = list(read_columnar(fp))
+        self.assertEqual([(row[0], row[3], row[5]) for row in rows], [(1, 'Text Frequency', 'Daily')])
+
+    # Test incremental columnar export from DB
+    def test_export_columnar_since_id(self):
+        """Test that a columnar export since a watermark round-trips the newer check-offs"""
+        out = io.BytesIO()
+        stats = HabitExporter(self.db, batch_size=7).write(out, 'columnar', since_id=250)
+        out.seek(0)
+        rows = list(read_columnar(out))
+        expected = self.db.fetch_all("SELECT id, check_date, habit_id FROM check_off WHERE id > ? ORDER BY id", (250,))
+        self.assertEqual([row[:3] for row in rows], expected)
+        self.assertEqual(stats['rows'], len(expected))
+
+    # Test date-range check-off reads from DB
+    def test_checkdates_since_until(self):
+        """Test that since/until limit the check-off dates read for a habit"""
+        dates = CheckOff.get_checkdates_for_habit(self.db, 1, since='2024-02-01', until='2024-02-29')
+        self.assertEqual(len(dates), 29)
+        self.assertEqual(str(dates[0]), '2024-02-01')
+        self.assertEqual(str(dates[-1]), '2024-02-29')
+        habit_analysis = HabitAnalysis(self.db)
+        self.assertEqual(habit_analysis.get_longest_streak(since='2024-03-01')[1], 30)
+
+    # Test habits with an unparseable window are still listed and analysed using a fresh in-memory DB
+    def test_unparseable_window_is_not_clipped(self):
+        """Test that a free-text startdate neither hides the habit nor breaks its streak"""
+        db = Database(db_name=':memory:')
+        Frequency(db, 'Daily').save()
+        Habit(db, 'Free Text', 'Test Description', 1, 'Jan 5', '').save()
+        for day in range(1, 4):
+            CheckOff(db, 1, f'2024-01-{day:02d} 00:00:00').save()
+        habit_analysis = HabitAnalysis(db)
+        self.assertEqual(len(Habit.get_all(db)), 1)
+        self.assertEqual(len(habit_analysis.get_habits_by_frequency('Daily')), 1)
+        self.assertEqual(habit_analysis.count_habits_by_frequency(), [('Daily', 1)])
+        self.assertEqual(habit_analysis.get_habit_streak(1, 1), 3)
+        self.assertEqual(habit_analysis.get_longest_streak()[1], 3)
+
+    # Test single-habit and batched streaks apply the same active window using a fresh in-memory DB
+    def test_active_window_rule_is_shared(self):
+        """Test that get_habit_streak and the leaderboard agree for startdates that are not plain dates"""
+        db = Database(db_name=':memory:')
+        Frequency(db, 'Daily').save()
+        for startdate in ('2024-01-05', '2024-01-05 09:00:00', '2024-1-5'):
+            Habit(db, startdate, 'Test Description', 1, startdate, '').save()
+        for habit_id in (1, 2, 3):
+            for day in range(1, 11):
+                CheckOff(db, habit_id, f'2024-01-{day:02d} 00:00:00').save()
+        habit_analysis = HabitAnalysis(db)
+        leaderboard = {habit[0]: streak for habit, streak in habit_analysis.get_leaderboard()}
+        self.assertEqual(leaderboard, {1: 6, 2: 6, 3: 10})
+        for habit_id, streak in leaderboard.items():
+            self.assertEqual(habit_analysis.get_habit_streak(habit_id, 1), streak)
+
+    # Test check-off listings keep id order from DB
+    def test_checkoffs_listed_in_id_order(self):
+        """Test that check-off listings come back in id order with and without a date range"""
+        ids = [row[0] for row in CheckOff.get_all(self.db)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), self.db.fetch_one("SELECT COUNT(*) FROM check_off")[0])
+        ids = [row[0] for row in CheckOff.get_all(self.db, since='2024-03-01')]
+        self.assertEqual(ids, sorted(ids))
+        ids = [row[0] for row in CheckOff.get_by_habit(self.db, 3)]
+        self.assertEqual(ids, sorted(ids))
+
+    # Test streaks are clipped to the habit's active window using a fresh in-memory DB
+    def test_streak_clipped_to_active_window(self):
+        """Test that check-offs outside a habit's startdate and enddate do not count"""
+        db = Database(db_name=':memory:')
+        Habit(db, 'Window Habit', 'Test Description', 1, '2024-01-05', '2024-01-10').save()
+        for day in range(1, 21):
+            CheckOff(db, 1, f'2024-01-{day:02d} 00:00:00').save()
+        habit_analysis = HabitAnalysis(db)
+        self.assertEqual(habit_analysis.get_habit_streak(1, 1), 6)
+        self.assertEqual(habit_analysis.get_habit_streak(1, 1, clip_to_active=False), 20)
+        self.assertEqual(habit_analysis.get_habit_streak(1, 1, since='2024-01-08'), 3)
+        self.assertEqual(habit_analysis.get_all_habits(since='2024-02-01'), [])
+        self.assertEqual([streak for _, streak in habit_analysis.get_leaderboard()], [6])
+        check_dates = CheckOff.get_checkdates_for_habits(db, [1], clip_to_active=True)
+        self.assertEqual([str(d) for d in (check_dates[1][0], check_dates[1][-1])], ['2024-01-05', '2024-01-10'])
+
+    # Test every registered query compiles against a fresh in-memory DB
+    def test_registered_queries_compile(self):
+        """Test that each statement in the query registry is valid SQL for the schema"""
+        db = Database(db_name=':memory:')
+        for name in QUERIES:
+            if name.endswith('.create') or name.startswith('catalog.create'):
+                db.execute_query(QUERIES[name])
+        for name in QUERIES:
+            with self.subTest(query=name):
+                db.fetch_all('EXPLAIN ' + QUERIES[name], (None,) * QUERIES[name].count('?'))
+
+    # Test batched reads from DB
+    def test_batched_reads(self):
+        """Test that the batched read APIs match the per-habit reads"""
+        habit_ids = [5, 3, 1, 42]
+        habits = Habit.get_many(self.db, habit_ids)
+        self.assertEqual([habit[0] for habit in habits], [1, 3, 5])
+        check_dates = CheckOff.get_checkdates_for_habits(self.db, habit_ids, since='2024-02-01')
+        for habit_id in habit_ids:
+            self.assertEqual(check_dates[habit_id], CheckOff.get_checkdates_for_habit(self.db, habit_id, since='2024-02-01'))
+        self.assertEqual(check_dates[42], [])
+        self.assertEqual(CheckOff.get_checkdates_for_habits(self.db, ['1'], since='2024-02-01')[1], check_dates[1])
+        self.assertEqual(Habit.get_many(self.db, ['1']), Habit.get_many(self.db, [1]))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file